@@ -1,20 +1,17 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import io
 import os
+import shutil
 
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.chart import BarChart, Reference
-from openpyxl.chart.label import DataLabelList
+from openpyxl import load_workbook
 
 # =========================
 # 업로드 폴더 설정
 # =========================
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-title_fill = PatternFill("solid", fgColor="DDDDDD")
-value_fill = PatternFill("solid", fgColor="FFFFFF")
+CACHE_DIR = os.path.join(UPLOAD_DIR, ".cache")
 
 # -------------------------
 # Streamlit 기본 설정
@@ -27,33 +24,123 @@ st.set_page_config(
 st.title("🚐 픽업 / 샌딩 시간대 월별 누적 집계 ")
 
 # -------------------------
-# 시간 파싱 함수
+# 상수 — Streamlit은 rerun마다 스크립트 전체를 재실행하므로 프로세스당 한 번만 생성
+# -------------------------
+@st.cache_resource
+def app_consts():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return {
+        "required_cols": ["출발일", "출발시간", "서비스"],
+        # 시간대 라벨 (✅ 00:00 형태)
+        "hour_labels": {h: f"{h:02d}:00" for h in range(24)},
+    }
+
+consts = app_consts()
+required_cols = consts["required_cols"]
+hour_labels = consts["hour_labels"]
+
+# -------------------------
+# 파일 로딩 (캐시)
 # -------------------------
-def parse_hour(value):
-    if pd.isna(value):
-        return None
+@st.cache_data(show_spinner=False)
+def load_file(path, mtime, size):
+    # 한 번 파싱한 파일은 parquet으로 캐시 — xlsx 재파싱보다 훨씬 빠르다
+    pq_path = os.path.join(CACHE_DIR, os.path.basename(path) + ".parquet")
+    if os.path.exists(pq_path) and os.path.getmtime(pq_path) >= mtime:
+        return pd.read_parquet(pq_path)
+
+    # read_only 모드로 셀 그래프 생성 없이 스트리밍 읽기 (수식 결과만, 필요한 3개 컬럼만)
+    wb = load_workbook(path, read_only=True, data_only=True)
     try:
-        value = str(value).strip()
-        if value == "":
-            return None
-        if ":" in value:
-            return int(value.split(":")[0])
-        return None
-    except:
-        return None
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, ())
+
+        # 필수 컬럼 체크
+        missing = [c for c in required_cols if c not in header]
+        if missing:
+            raise ValueError(f"필수 컬럼이 없습니다: {missing}")
+
+        i_date, i_time, i_svc = (header.index(c) for c in required_cols)
+
+        dates, times, services = [], [], []
+        for row in rows:
+            n = len(row)
+            dates.append(row[i_date] if i_date < n else None)
+            times.append(row[i_time] if i_time < n else None)
+            services.append(row[i_svc] if i_svc < n else None)
+    finally:
+        wb.close()
+
+    # 셀 타입이 섞여 있을 수 있으므로(날짜/시간 객체 + 문자열) parquet에
+    # 안전한 dtype으로 통일 — 출발일은 요소별 파싱으로 datetime64로, 서비스는
+    # 문자열로 만들고, 출발시간은 시(hour)로만 소비한다
+    df = pd.DataFrame({
+        "출발일": pd.to_datetime(pd.Series(dates, dtype=object), errors="coerce"),
+        "서비스": pd.Series(services, dtype=object).astype("string"),
+    })
+    s = pd.Series(times, dtype=object).astype("string").str.strip()
+    s = s.where(s.str.contains(":", na=False))
+    hours = pd.to_numeric(s.str.split(":").str[0], errors="coerce")
+    df["시간"] = hours.where(hours.between(0, 23)).astype("Int8")  # 범위 밖은 NA
+
+    try:
+        df.to_parquet(pq_path)
+    except OSError:
+        pass  # 캐시 저장 실패는 치명적이지 않음 — 파싱 결과는 그대로 사용
+    return df
+
+# -------------------------
+# 파일별 집계 (캐시) — 파일 하나를 (서비스코드, 연월, 시간)별 건수로 정제
+# -------------------------
+@st.cache_data(show_spinner=False)
+def file_counts(path, mtime, size):
+    df = load_file(path, mtime, size)
+
+    # 날짜 / 시간 처리 (출발일은 load_file에서 이미 datetime64로 파싱됨)
+    df["연월"] = df["출발일"].dt.strftime("%Y-%m")
+
+    # 서비스 구분 (P=픽업, S=샌딩) — int8 카테고리 코드로 필터
+    df["서비스코드"] = (
+        df["서비스"].astype("category").cat.set_categories(["P", "S"]).cat.codes
+    )
+    df = df[df["서비스코드"] >= 0]
+    df = df.dropna(subset=["연월", "시간"])
+    df = df[df["시간"].between(0, 23)]  # 범위 밖 시간은 집계 제외 (기존 reindex와 동일)
+
+    # (서비스코드, 연월, 시간)을 평탄한 정수 코드로 만들어 bincount 한 번으로 센다
+    # — groupby 디스패치 없이 C 속도의 단일 패스 히스토그램
+    month_codes, months = pd.factorize(df["연월"], sort=True)
+    svc = df["서비스코드"].to_numpy(np.int64)
+    hour = df["시간"].to_numpy(np.int64)
+    flat = (svc * len(months) + month_codes) * 24 + hour
+    hist = np.bincount(flat, minlength=2 * len(months) * 24)
+
+    index = pd.MultiIndex.from_product(
+        [[0, 1], months, range(24)], names=["서비스코드", "연월", "시간"]
+    )
+    return pd.Series(hist, index=index)
+
+# -------------------------
+# 업로드 폴더 목록 (캐시) — scandir로 stat 정보까지 한 번에 수집
+# -------------------------
+@st.cache_data(ttl=5, show_spinner=False)
+def list_uploads():
+    return sorted(
+        (e.name, e.stat().st_mtime, e.stat().st_size)
+        for e in os.scandir(UPLOAD_DIR)
+        if e.name.lower().endswith(".xlsx")
+    )
 
 # =========================
 # 업로드된 파일 목록 + 삭제
 # =========================
 st.subheader("📁 업로드된 파일 목록")
 
-stored_files = sorted([
-    f for f in os.listdir(UPLOAD_DIR)
-    if f.lower().endswith(".xlsx")
-])
+stored_files = list_uploads()
 
 if stored_files:
-    for file_name in stored_files:
+    for file_name, _, _ in stored_files:
         col1, col2, col3 = st.columns([6, 2, 2])
 
         # 파일명
@@ -73,6 +160,10 @@ if stored_files:
         # 삭제 버튼
         if col3.button("❌ 삭제", key=f"del_{file_name}"):
             os.remove(file_path)
+            cache_path = os.path.join(CACHE_DIR, file_name + ".parquet")
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            list_uploads.clear()
             st.rerun()
 else:
     st.info("업로드된 파일이 없습니다.")
@@ -91,107 +182,104 @@ if uploaded_files:
     for file in uploaded_files:
         save_path = os.path.join(UPLOAD_DIR, file.name)
         with open(save_path, "wb") as f:
-            f.write(file.getbuffer())
+            shutil.copyfileobj(file, f, 1024 * 1024)  # 1MB씩 스트리밍 저장
     st.success("파일이 저장되었습니다.")
+    list_uploads.clear()
     st.rerun()
 
 # =========================
 # 저장된 파일로 통계 처리
 # =========================
 if stored_files:
-    dfs = []
+    # 파일별로 먼저 집계한 뒤 작은 결과만 합산 — concat 후 집계보다
+    # 피크 메모리가 가장 큰 파일 하나 수준으로 줄어든다 (count는 합산 가능)
+    counts = None
 
-    for fname in stored_files:
+    for fname, mtime, size in stored_files:
         path = os.path.join(UPLOAD_DIR, fname)
-        df = pd.read_excel(path)
-        df["__source_file"] = fname
-        dfs.append(df)
-
-    df = pd.concat(dfs, ignore_index=True)
-
-    # 필수 컬럼 체크
-    required_cols = ["출발일", "출발시간", "서비스"]
-    missing = [c for c in required_cols if c not in df.columns]
-    if missing:
-        st.error(f"필수 컬럼이 없습니다: {missing}")
-        st.stop()
-
-    # 날짜 / 시간 처리
-    df["출발일"] = pd.to_datetime(df["출발일"], errors="coerce")
-    df["연월"] = df["출발일"].dt.strftime("%Y-%m")
-    df["시간"] = df["출발시간"].apply(parse_hour)
-
-    # 서비스 구분
-    df["서비스명"] = df["서비스"].map({"P": "픽업", "S": "샌딩"})
-    df = df.dropna(subset=["연월", "시간", "서비스명"])
-
-    # 시간대 라벨 (✅ 00:00 형태로 변경)
-    hour_labels = {h: f"{str(h).zfill(2)}:00" for h in range(24)}
+        try:
+            per_file = file_counts(path, mtime, size)
+        except ValueError as e:
+            st.error(f"{fname}: {e}")
+            st.stop()
+        counts = per_file if counts is None else counts.add(per_file, fill_value=0)
 
     # -------------------------
-    # 피벗 테이블 생성 함수
+    # 피벗 테이블 생성 함수 (캐시)
     # -------------------------
-    def make_pivot(service_name):
-        temp = df[df["서비스명"] == service_name]
-
-        pivot = (
-            temp.pivot_table(
-                index="연월",
-                columns="시간",
-                values="서비스명",
-                aggfunc="count",
-                fill_value=0
+    @st.cache_data(show_spinner=False)
+    def make_pivots(counts):
+        # 픽업(0)/샌딩(1) 집계를 한 번에 펼친 뒤 둘로 나눈다
+        all_pv = (
+            counts.unstack(["서비스코드", "시간"], fill_value=0)
+            .reindex(  # 모든 서비스/시간대 컬럼 보장
+                columns=pd.MultiIndex.from_product([[0, 1], range(24)]),
+                fill_value=0,
             )
-            .rename(columns=hour_labels)
         )
 
-        # 모든 시간대 컬럼 보장
-        for col in hour_labels.values():
-            if col not in pivot.columns:
-                pivot[col] = 0
-
-        pivot = pivot[list(hour_labels.values())]
-        pivot["총 건수"] = pivot.sum(axis=1)
-        pivot = pivot.sort_index(ascending=False)
-
-        # 총합계 행
-        total_row = pivot.sum().to_frame().T
-        total_row.index = ["총합계"]
-        pivot = pd.concat([pivot, total_row])
+        def finish(pivot):
+            pivot = pivot.rename(columns=hour_labels).sort_index(ascending=False)
+
+            # 총 건수 컬럼 + 총합계 행을 numpy로 계산해 한 번의 할당으로 조립
+            # (건수는 uint32로 충분 — 메모리와 엑셀 기록량을 줄인다)
+            arr = pivot.to_numpy(dtype="uint32")
+            row_tot = arr.sum(axis=1, dtype="uint32")
+            col_tot = arr.sum(axis=0, dtype="uint32")
+            full = np.vstack([
+                np.column_stack([arr, row_tot]),
+                np.append(col_tot, row_tot.sum(dtype="uint32")),
+            ])
+            return pd.DataFrame(
+                full,
+                index=list(pivot.index) + ["총합계"],
+                columns=list(pivot.columns) + ["총 건수"],
+            )
 
-        return pivot
+        return finish(all_pv[0]), finish(all_pv[1])
 
-    pickup_df = make_pivot("픽업")
-    sending_df = make_pivot("샌딩")
+    pickup_df, sending_df = make_pivots(counts)
 
     # -------------------------
     # 화면 표시
     # -------------------------
+    # arrow 백엔드로 변환해 두면 rerun마다 직렬화 비용이 줄어든다
+    pickup_arrow = pickup_df.convert_dtypes(dtype_backend="pyarrow")
+    sending_arrow = sending_df.convert_dtypes(dtype_backend="pyarrow")
+
     st.subheader("📊 픽업 (누적)")
-    st.dataframe(pickup_df, use_container_width=True)
+    st.dataframe(pickup_arrow, use_container_width=True, height=400)
 
     st.subheader("📊 샌딩 (누적)")
-    st.dataframe(sending_df, use_container_width=True)
+    st.dataframe(sending_arrow, use_container_width=True, height=400)
 
     # -------------------------
     # 엑셀 다운로드 + 대시보드
     # -------------------------
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+    with pd.ExcelWriter(
+        output,
+        engine="xlsxwriter",
+        engine_kwargs={
+            "options": {
+                "in_memory": True,            # 임시 파일 없이 메모리에서 바로 조립
+                "strings_to_formulas": False,  # 문자열마다 수식/URL 검사 생략
+                "strings_to_urls": False,
+            }
+        },
+    ) as writer:
         pickup_df.to_excel(writer, sheet_name="픽업")
         sending_df.to_excel(writer, sheet_name="샌딩")
 
         wb = writer.book
-        ws_pickup = wb["픽업"]
-        ws_sending = wb["샌딩"]
+        ws_pickup = writer.sheets["픽업"]
+        ws_sending = writer.sheets["샌딩"]
 
-        bold = Font(bold=True)
+        bold = wb.add_format({"bold": True})
 
-        # 총합계 행 굵게
-        for ws in [ws_pickup, ws_sending]:
-            last_row = ws.max_row
-            for col in range(1, ws.max_column + 1):
-                ws.cell(row=last_row, column=col).font = bold
+        # 총합계 행 굵게 (0행 = 헤더, 데이터 행 수 = len(df))
+        ws_pickup.set_row(len(pickup_df), None, bold)
+        ws_sending.set_row(len(sending_df), None, bold)
 
         # 최대 시간대 계산
         pickup_peak = pickup_df.loc["총합계"].drop("총 건수").idxmax()
@@ -200,188 +288,68 @@ if stored_files:
         # -------------------------
         # 대시보드 시트
         # -------------------------
-        ws_dash = wb.create_sheet("대시보드")
-
-        kpi_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin")
-        )
-
-        # 배경 (연한 회색) - 대시보드 전체 영역
-        bg_fill = PatternFill("solid", fgColor="EEEEEE")
-        for row in range(1, 81):
-            for col in range(1, 41):
-                ws_dash.cell(row=row, column=col).fill = bg_fill
+        ws_dash = wb.add_worksheet("대시보드")
+
+        # 배경 (연한 회색) - 대시보드 전체 영역을 컬럼 기본 서식 한 번으로 처리
+        bg_fmt = wb.add_format({"bg_color": "#EEEEEE"})
+        ws_dash.set_column("A:AN", None, bg_fmt)
+
+        # KPI 서식 — 타일마다 새로 만들지 않고 한 번만 생성해서 재사용
+        kpi_title_fmt = wb.add_format({
+            "bold": True,
+            "align": "center", "valign": "vcenter",
+            "bg_color": "#DDDDDD", "border": 1,
+        })
+        kpi_value_fmt = wb.add_format({
+            "bold": True, "font_size": 16,
+            "align": "center", "valign": "vcenter",
+            "bg_color": "#FFFFFF", "border": 1,
+        })
 
         # KPI 함수
         def kpi(title_cell, value_cell, title, value):
-            ws_dash.merge_cells(title_cell)
-            ws_dash.merge_cells(value_cell)
-
-            title_anchor = title_cell.split(":")[0]
-            value_anchor = value_cell.split(":")[0]
-
-            ws_dash[title_anchor] = title
-            ws_dash[value_anchor] = value
-
-            ws_dash[title_anchor].font = Font(bold=True)
-            ws_dash[value_anchor].font = Font(bold=True, size=16)
-
-            ws_dash[title_anchor].alignment = Alignment(horizontal="center", vertical="center")
-            ws_dash[value_anchor].alignment = Alignment(horizontal="center", vertical="center")
-
-            for row in ws_dash[title_cell]:
-                for cell in row:
-                    cell.fill = title_fill
-                    cell.border = kpi_border
-            for row in ws_dash[value_cell]:
-                for cell in row:
-                    cell.fill = value_fill
-                    cell.border = kpi_border
+            ws_dash.merge_range(title_cell, title, kpi_title_fmt)
+            ws_dash.merge_range(value_cell, value, kpi_value_fmt)
 
         # KPI 배치
-        kpi("B2:D2", "B3:D4", "총 픽업 건수", pickup_df.loc["총합계", "총 건수"])
-        kpi("F2:H2", "F3:H4", "총 샌딩 건수", sending_df.loc["총합계", "총 건수"])
+        kpi("B2:D2", "B3:D4", "총 픽업 건수", int(pickup_df.loc["총합계", "총 건수"]))
+        kpi("F2:H2", "F3:H4", "총 샌딩 건수", int(sending_df.loc["총합계", "총 건수"]))
         kpi("J2:L2", "J3:L4", "픽업 최대 시간대", pickup_peak)
         kpi("N2:P2", "N3:P4", "샌딩 최대 시간대", sending_peak)
 
-        ws_dash.merge_cells("B6:P6")
-        ws_dash["B6"] = "픽업 시간별 건수"
-        ws_dash["B6"].font = Font(bold=True, size=22)
-        ws_dash["B6"].alignment = Alignment(horizontal="center", vertical="center")
-
-        # 배경색 (연회색보다 살짝 진하게)
-        title_fill = PatternFill("solid", fgColor="DDDDDD")
-
-        # 테두리 스타일
-        title_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin")
-        )
-
-        # 병합된 영역 전체에 배경 + 테두리 적용
-        for row in ws_dash["B6:P6"]:
-            for cell in row:
-                cell.fill = title_fill
-                cell.border = title_border
-
+        # 섹션 제목 (배경은 연회색보다 살짝 진하게)
+        section_fmt = wb.add_format({
+            "bold": True, "font_size": 22,
+            "align": "center", "valign": "vcenter",
+            "bg_color": "#DDDDDD", "border": 1,
+        })
+        ws_dash.merge_range("B6:P6", "픽업 시간별 건수", section_fmt)
+
+        # 시간별 건수 차트 — 픽업/샌딩 공용 생성 함수
+        def time_chart(sheet_name, pivot):
+            chart = wb.add_chart({"type": "column"})
+            chart.add_series({
+                # 총합계 행의 시간대 24개 컬럼 (B열~Y열, '총 건수' 제외)
+                "values": [sheet_name, len(pivot), 1, len(pivot), 24],
+                "categories": [sheet_name, 0, 1, 0, 24],  # 시간 헤더
+                "data_labels": {"value": True, "position": "outside_end"},  # 막대 위 값 표시
+            })
+            chart.set_legend({"none": True})
+            chart.set_size({"width": 1058, "height": 454})  # 28cm x 12cm
+            chart.set_x_axis({"major_tick_mark": "outside", "minor_tick_mark": "none"})
+            return chart
 
         # -------------------------
         # 픽업 차트
         # -------------------------
-        pickup_chart = BarChart()
-        pickup_chart.title = None
-        pickup_chart.legend = None
-        pickup_chart.height = 12
-        pickup_chart.width = 28
-        pickup_chart.dataLabels = DataLabelList()
-        pickup_chart.dataLabels.showVal = True      # 값만 표시
-        pickup_chart.dataLabels.showCatName = False # 시간 안씀 (축에만)
-        pickup_chart.dataLabels.showSerName = False # ❌ 계열1 제거
-        pickup_chart.dataLabels.dLblPos = "outEnd"
-
-        pickup_chart.add_data(
-            Reference(
-                ws_pickup,
-                min_col=2,
-                min_row=ws_pickup.max_row,          # 총합계 행
-                max_col=ws_pickup.max_column - 1,   # '총 건수' 제외
-                max_row=ws_pickup.max_row
-            ),
-            titles_from_data=False,
-            from_rows=True  # ✅ 핵심
-        )
-
-        pickup_chart.set_categories(
-            Reference(
-                ws_pickup,
-                min_col=2,
-                min_row=1,                          # 시간 헤더
-                max_col=ws_pickup.max_column - 1,
-                max_row=1
-            )
-        )
-
-        # ✅ 막대 위 값 표시
-        
-        pickup_chart.x_axis.tickLblPos = "nextTo"
-        pickup_chart.x_axis.majorTickMark = "out"
-        pickup_chart.x_axis.minorTickMark = "none"
-        pickup_chart.x_axis.delete = False
-
-        ws_dash.add_chart(pickup_chart, "B8")
+        ws_dash.insert_chart("B8", time_chart("픽업", pickup_df))
 
         # -------------------------
         # 샌딩 차트
         # -------------------------
-        ws_dash.merge_cells("B30:P30")
-        ws_dash["B30"] = "센딩 시간별 건수"
-        ws_dash["B30"].font = Font(bold=True, size=22)
-        ws_dash["B30"].alignment = Alignment(horizontal="center", vertical="center")
-
-        # 배경색 (연회색보다 살짝 진하게)
-        title_fill = PatternFill("solid", fgColor="DDDDDD")
-
-        # 테두리 스타일
-        title_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin")
-        )
-
-        # 병합된 영역 전체에 배경 + 테두리 적용
-        for row in ws_dash["B30:P30"]:
-            for cell in row:
-                cell.fill = title_fill
-                cell.border = title_border
-
-
-
-        sending_chart = BarChart()
-        sending_chart.title = None
-        sending_chart.legend = None
-        sending_chart.height = 12
-        sending_chart.width = 28
-        sending_chart.dataLabels = DataLabelList()
-        sending_chart.dataLabels.showVal = True
-        sending_chart.dataLabels.showCatName = False
-        sending_chart.dataLabels.showSerName = False
-        sending_chart.dataLabels.dLblPos = "outEnd"       
-
-        sending_chart.add_data(
-            Reference(
-                ws_sending,
-                min_col=2,
-                min_row=ws_sending.max_row,         # 총합계 행
-                max_col=ws_sending.max_column - 1,  # '총 건수' 제외
-                max_row=ws_sending.max_row
-            ),
-            titles_from_data=False,
-            from_rows=True  # ✅ 핵심
-        )
-
-        sending_chart.set_categories(
-            Reference(
-                ws_sending,
-                min_col=2,
-                min_row=1,
-                max_col=ws_sending.max_column - 1,
-                max_row=1
-            )
-        )
-
-        # ✅ 막대 위 값 표시
-        sending_chart.x_axis.tickLblPos = "nextTo"
-        sending_chart.x_axis.majorTickMark = "out"
-        sending_chart.x_axis.minorTickMark = "none"
-        sending_chart.x_axis.delete = False
+        ws_dash.merge_range("B30:P30", "센딩 시간별 건수", section_fmt)
 
-        ws_dash.add_chart(sending_chart, "B33")
+        ws_dash.insert_chart("B33", time_chart("샌딩", sending_df))
 
     # -------------------------
     # 다운로드 버튼